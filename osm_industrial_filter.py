@@ -1,33 +1,196 @@
 #!/usr/bin/env python3
 
-import overpy
-import geojson
+import hashlib
 import json
+import numpy as np
+import os
 import requests
 import urllib.parse
-from shapely.geometry import Polygon, Point
-from shapely.ops import transform
 import pyproj
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
 import argparse
+import logging
+import math
 import sys
 import time
 from typing import List, Dict, Tuple, Optional
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import shapely
+    if not hasattr(shapely, 'linearrings'):
+        shapely = None
+except ImportError:
+    shapely = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "osm-ind-filter")
+RESERVED_PROPERTY_KEYS = frozenset({'osm_id', 'osm_type', 'landuse', 'area_sqm', 'area_hectares'})
+COUNTRY_BBOX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "country_bboxes.json")
+NOMINATIM_CACHE_FILE = os.path.join(CACHE_DIR, "nominatim.json")
+
+logger = logging.getLogger(__name__)
+
+_last_nominatim_request = 0.0
+
+@lru_cache(maxsize=1)
+def _load_country_bboxes() -> Dict[str, List[float]]:
+    try:
+        with open(COUNTRY_BBOX_FILE, 'r', encoding='utf-8') as f:
+            return {name.lower(): bbox for name, bbox in json.load(f).items()}
+    except (OSError, ValueError):
+        return {}
+
+_UTM_PIPELINES = {
+    epsg: (
+        "+proj=pipeline "
+        "+step +proj=unitconvert +xy_in=deg +xy_out=rad "
+        f"+step +proj=utm +zone={zone} +ellps=WGS84{' +south' if south else ''}"
+    )
+    for zone in range(1, 61)
+    for epsg, south in ((32600 + zone, False), (32700 + zone, True))
+}
+
+@lru_cache(maxsize=256)
+def _get_utm_transformer(utm_epsg: int) -> pyproj.Transformer:
+    pipeline = _UTM_PIPELINES.get(utm_epsg)
+    if pipeline is not None:
+        return pyproj.Transformer.from_pipeline(pipeline)
+
+    return pyproj.Transformer.from_crs(4326, utm_epsg, always_xy=True)
+
+def _utm_epsg_for(lon: float, lat: float) -> int:
+    utm_zone = int((lon + 180) / 6) + 1
+    return 32600 + utm_zone if lat >= 0 else 32700 + utm_zone
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _shoelace(x, y):
+        s = 0.0
+        n = x.shape[0]
+        for i in range(n):
+            j = (i + 1) % n
+            s += x[i] * y[j] - x[j] * y[i]
+        return 0.5 * abs(s)
+
+    _shoelace(np.zeros(3), np.zeros(3))
+else:
+    def _shoelace(x: np.ndarray, y: np.ndarray) -> float:
+        return 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+
+def _zone_areas(utm_epsg: int, lons: np.ndarray, lats: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    xs, ys = _get_utm_transformer(utm_epsg).transform(lons, lats)
+    ring_count = len(offsets) - 1
+
+    if njit is None and shapely is not None:
+        ring_index = np.repeat(np.arange(ring_count), np.diff(offsets))
+        rings = shapely.linearrings(np.column_stack((xs, ys)), indices=ring_index)
+        return shapely.area(shapely.polygons(rings))
+
+    areas = np.empty(ring_count)
+    for k in range(ring_count):
+        areas[k] = _shoelace(xs[offsets[k]:offsets[k + 1]], ys[offsets[k]:offsets[k + 1]])
+    return areas
+
+def _approx_bbox_sqm(lons: np.ndarray, lats: np.ndarray) -> float:
+    lat_min, lat_max = lats.min(), lats.max()
+    lat_mid = math.radians((lat_min + lat_max) / 2)
+    return (lons.max() - lons.min()) * (lat_max - lat_min) * math.cos(lat_mid) * 111320.0 ** 2
+
+def _batch_calculate_areas(rings: List[Tuple[np.ndarray, np.ndarray]], min_area_sqm: Optional[float] = None) -> np.ndarray:
+    areas = np.zeros(len(rings))
+
+    buckets: Dict[int, List[int]] = {}
+    for i, (lons, lats) in enumerate(rings):
+        if lons.shape[0] < 3:
+            continue
+
+        if min_area_sqm is not None:
+            approx_sqm = _approx_bbox_sqm(lons, lats)
+            if approx_sqm < 0.5 * min_area_sqm:
+                areas[i] = approx_sqm
+                continue
+
+        utm_epsg = _utm_epsg_for(lons.mean(), lats.mean())
+        buckets.setdefault(utm_epsg, []).append(i)
+
+    batches = []
+    for utm_epsg, indices in buckets.items():
+        offsets = np.cumsum([0] + [rings[i][0].shape[0] for i in indices])
+        lons = np.concatenate([rings[i][0] for i in indices])
+        lats = np.concatenate([rings[i][1] for i in indices])
+        batches.append((utm_epsg, lons, lats, offsets, indices))
+
+    if len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(batches))) as executor:
+            futures = [(indices, executor.submit(_zone_areas, utm_epsg, lons, lats, offsets))
+                       for utm_epsg, lons, lats, offsets, indices in batches]
+            for indices, future in futures:
+                areas[indices] = future.result()
+    else:
+        for utm_epsg, lons, lats, offsets, indices in batches:
+            areas[indices] = _zone_areas(utm_epsg, lons, lats, offsets)
+
+    return areas
+
 class OSMIndustrialFilter:
-    def __init__(self, min_area_sqm: float = 10000, bbox: Optional[Tuple[float, float, float, float]] = None, country: Optional[str] = None):
-        self.api = overpy.Overpass(url="https://overpass.kumi.systems/api/interpreter")
+    def __init__(self, min_area_sqm: float = 10000, bbox: Optional[Tuple[float, float, float, float]] = None, country: Optional[str] = None, tile_degrees: float = 2.0):
+        self.overpass_url = "https://overpass.kumi.systems/api/interpreter"
+        self.session = requests.Session()
+        adapter = HTTPAdapter(max_retries=Retry(total=3, backoff_factor=2, status_forcelist=(429, 502, 504), allowed_methods=None))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.min_area_sqm = min_area_sqm
         self.bbox = bbox
         self.country = country
+        self.tile_degrees = tile_degrees
         self.filtered_features = []
         
         if country and not bbox:
             self.bbox = self.get_country_bbox(country)
         
+    def _load_nominatim_cache(self) -> Dict[str, List[float]]:
+        try:
+            with open(NOMINATIM_CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_nominatim_cache(self, key: str, bbox: Tuple[float, float, float, float]) -> None:
+        cache = self._load_nominatim_cache()
+        cache[key] = list(bbox)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(NOMINATIM_CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+
     def get_country_bbox(self, country_name: str) -> Optional[Tuple[float, float, float, float]]:
+        global _last_nominatim_request
+
+        key = country_name.strip().lower()
+
+        static_bbox = _load_country_bboxes().get(key)
+        if static_bbox:
+            print(f"Using shipped bounding box for country: {country_name}")
+            return tuple(static_bbox)
+
+        cached_bbox = self._load_nominatim_cache().get(key)
+        if cached_bbox:
+            print(f"Using cached bounding box for country: {country_name}")
+            return tuple(cached_bbox)
+
         print(f"Looking up bounding box for country: {country_name}")
-        
+
         nominatim_url = "https://nominatim.openstreetmap.org/search"
         
         params = {
@@ -43,8 +206,13 @@ class OSMIndustrialFilter:
             'User-Agent': 'OSM-Industrial-Filter/1.0 (https://github.com/user/repo)'
         }
         
+        wait = 1.0 - (time.monotonic() - _last_nominatim_request)
+        if wait > 0:
+            time.sleep(wait)
+        _last_nominatim_request = time.monotonic()
+
         try:
-            response = requests.get(nominatim_url, params=params, headers=headers, timeout=30)
+            response = self.session.get(nominatim_url, params=params, headers=headers, timeout=30)
             response.raise_for_status()
             
             results = response.json()
@@ -64,10 +232,11 @@ class OSMIndustrialFilter:
                 bbox_str = result['boundingbox']
                 south, north, west, east = map(float, bbox_str)
                 bbox = (south, west, north, east)
-                
+
                 print(f"Found bounding box for {result.get('display_name', country_name)}")
                 print(f"Bounding box: South={south}, West={west}, North={north}, East={east}")
-                
+
+                self._save_nominatim_cache(key, bbox)
                 return bbox
             else:
                 print(f"No bounding box found for: {country_name}")
@@ -79,85 +248,155 @@ class OSMIndustrialFilter:
         except (ValueError, KeyError, IndexError) as e:
             print(f"Error parsing country data: {e}")
             return None
-        
-        time.sleep(1)
-        
-    def build_query(self) -> str:
-        bbox_filter = ""
-        if self.bbox:
-            south, west, north, east = self.bbox
-            bbox_filter = f"({south},{west},{north},{east})"
-            if self.country:
-                print(f"Querying industrial areas in {self.country}")
-            else:
-                print(f"Querying industrial areas in bounding box: {bbox_filter}")
-        
+
+    def _bbox_filter(self, bbox: Optional[Tuple[float, float, float, float]] = None) -> str:
+        bbox = bbox or self.bbox
+        if not bbox:
+            return ""
+
+        south, west, north, east = bbox
+        return f"({south},{west},{north},{east})"
+
+    def build_way_query(self, bbox: Optional[Tuple[float, float, float, float]] = None) -> str:
+        query = f"""
+        [out:json][timeout:3000];
+        way["landuse"="industrial"]{self._bbox_filter(bbox)};
+        out geom;
+        """
+        return query
+
+    def build_relation_query(self, bbox: Optional[Tuple[float, float, float, float]] = None) -> str:
         query = f"""
         [out:json][timeout:3000];
-        (
-          way["landuse"="industrial"]{bbox_filter};
-          relation["landuse"="industrial"]{bbox_filter};
-        );
-        (._;>;);
+        relation["landuse"="industrial"]{self._bbox_filter(bbox)};
         out geom;
         """
         return query
+
+    def _tile_bboxes(self) -> List[Optional[Tuple[float, float, float, float]]]:
+        if not self.bbox:
+            return [None]
+
+        south, west, north, east = self.bbox
+        step = self.tile_degrees
+        if step <= 0 or (north - south <= step and east - west <= step):
+            return [self.bbox]
+
+        tiles = []
+        lat = south
+        while lat < north:
+            lat_top = min(lat + step, north)
+            lon = west
+            while lon < east:
+                tiles.append((lat, lon, lat_top, min(lon + step, east)))
+                lon += step
+            lat += step
+        return tiles
+
+    def _check_overpass_remark(self, data: Dict) -> None:
+        remark = data.get('remark')
+        if not remark:
+            return
+
+        if 'runtime error' in remark:
+            raise RuntimeError(f"Overpass runtime error: {remark}")
+
+        logger.warning("Overpass remark: %s", remark)
+
+    def _fetch_tile(self, query: str) -> Dict:
+        cache_file = os.path.join(CACHE_DIR, f"{hashlib.sha1(query.encode('utf-8')).hexdigest()}.json")
+
+        if os.path.exists(cache_file):
+            with open(cache_file, 'rb') as f:
+                raw = f.read()
+
+            data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+            try:
+                self._check_overpass_remark(data)
+            except RuntimeError:
+                os.remove(cache_file)
+                raise
+            return data
+
+        response = self.session.post(self.overpass_url, data=query.encode('utf-8'), timeout=3600)
+        response.raise_for_status()
+        raw = response.content
+
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        self._check_overpass_remark(data)
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_file, 'wb') as f:
+            f.write(raw)
+
+        return data
     
     def calculate_area(self, geometry: List[Tuple[float, float]]) -> float:
-        if len(geometry) < 3:
+        ring = np.asarray(geometry, dtype=np.float64).reshape(-1, 2)
+        if ring.shape[0] < 3:
             return 0
-        
-        polygon = Polygon(geometry)
-        
-        centroid = polygon.centroid
-        lon, lat = centroid.x, centroid.y
-        
-        utm_zone = int((lon + 180) / 6) + 1
-        utm_epsg = 32600 + utm_zone if lat >= 0 else 32700 + utm_zone
-        
-        wgs84 = pyproj.CRS('EPSG:4326')
-        utm = pyproj.CRS(f'EPSG:{utm_epsg}')
-        project = pyproj.Transformer.from_crs(wgs84, utm, always_xy=True).transform
-        
-        utm_polygon = transform(project, polygon)
-        return utm_polygon.area
-    
-    def way_to_coordinates(self, way) -> List[Tuple[float, float]]:
-        return [(float(node.lon), float(node.lat)) for node in way.nodes]
-    
-    def relation_to_coordinates(self, relation) -> List[List[Tuple[float, float]]]:
-        outer_rings = []
-        inner_rings = []
-        
-        for member in relation.members:
-            if member.role == "outer" and hasattr(member, 'nodes'):
-                coords = [(float(node.lon), float(node.lat)) for node in member.nodes]
-                if len(coords) >= 3:
-                    outer_rings.append(coords)
-            elif member.role == "inner" and hasattr(member, 'nodes'):
-                coords = [(float(node.lon), float(node.lat)) for node in member.nodes]
-                if len(coords) >= 3:
-                    inner_rings.append(coords)
-        
-        return outer_rings + inner_rings
+
+        return float(_batch_calculate_areas([(np.ascontiguousarray(ring[:, 0]), np.ascontiguousarray(ring[:, 1]))])[0])
+
+    def way_to_coordinates(self, way: Dict, nodes: Dict[int, Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        geometry = way.get('geometry')
+        if geometry is not None:
+            count = len(geometry)
+            lons = np.fromiter((point['lon'] for point in geometry), dtype=np.float64, count=count)
+            lats = np.fromiter((point['lat'] for point in geometry), dtype=np.float64, count=count)
+            return lons, lats
+
+        resolved = [nodes[ref] for ref in way.get('nodes', []) if ref in nodes]
+        count = len(resolved)
+        lons = np.fromiter((lon for lon, _ in resolved), dtype=np.float64, count=count)
+        lats = np.fromiter((lat for _, lat in resolved), dtype=np.float64, count=count)
+        return lons, lats
+
+    def relation_to_coordinates(self, relation: Dict, nodes: Dict[int, Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        best_ring = None
+        best_extent = -1.0
+
+        for member in relation.get('members', []):
+            if member.get('type') != 'way' or member.get('role') != 'outer':
+                continue
+
+            if len(member.get('geometry') or member.get('nodes') or ()) < 3:
+                continue
+
+            lons, lats = self.way_to_coordinates(member, nodes)
+            if lons.shape[0] < 3:
+                continue
+
+            extent = (lons.max() - lons.min()) * (lats.max() - lats.min())
+            if extent > best_extent:
+                best_extent = extent
+                best_ring = (lons, lats)
+
+        if best_ring is None:
+            empty = np.empty(0, dtype=np.float64)
+            return empty, empty
+
+        return best_ring
     
-    def create_geojson_feature(self, element, coordinates: List[Tuple[float, float]], area: float) -> Dict:
-        if coordinates[0] != coordinates[-1]:
-            coordinates.append(coordinates[0])
-        
+    def create_geojson_feature(self, element: Dict, ring: Tuple[np.ndarray, np.ndarray], area: float) -> Dict:
+        lons, lats = ring
+        if lons[0] != lons[-1] or lats[0] != lats[-1]:
+            lons = np.append(lons, lons[0])
+            lats = np.append(lats, lats[0])
+
+        coordinates = np.column_stack((lons, lats)).tolist()
+
+        tags = element.get('tags', {})
         properties = {
-            'osm_id': element.id,
-            'osm_type': 'way' if hasattr(element, 'nodes') else 'relation',
+            **{key: value for key, value in tags.items() if key not in RESERVED_PROPERTY_KEYS},
+            'osm_id': element['id'],
+            'osm_type': element['type'],
             'landuse': 'industrial',
             'area_sqm': round(area, 2),
             'area_hectares': round(area / 10000, 2)
         }
-        
-        for key, value in element.tags.items():
-            if key not in properties:
-                properties[key] = value
-        
-        feature = {
+
+        return {
             'type': 'Feature',
             'properties': properties,
             'geometry': {
@@ -165,71 +404,92 @@ class OSMIndustrialFilter:
                 'coordinates': [coordinates]
             }
         }
-        
-        return feature
     
     def fetch_and_filter(self) -> List[Dict]:
         print("Fetching industrial land use data from OpenStreetMap...")
-        
-        query = self.build_query()
-        print(f"Query: {query}")
-        
+
+        if self.country:
+            print(f"Querying industrial areas in {self.country}")
+        elif self.bbox:
+            print(f"Querying industrial areas in bounding box: {self.bbox}")
+
+        tiles = self._tile_bboxes()
+        queries = [self.build_way_query(tile) for tile in tiles] + [self.build_relation_query(tile) for tile in tiles]
+        if len(tiles) > 1:
+            print(f"Split bounding box into {len(tiles)} tiles ({len(queries)} queries)")
+
+        ways = []
+        relations = []
+        nodes: Dict[int, Tuple[float, float]] = {}
+        seen = set()
+
         try:
-            result = self.api.query(query)
-            print(f"Found {len(result.ways)} ways and {len(result.relations)} relations")
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                for data in executor.map(self._fetch_tile, queries):
+                    for element in data.get('elements', []):
+                        element_type = element.get('type')
+                        if element_type == 'node':
+                            nodes[element['id']] = (element['lon'], element['lat'])
+                        elif element_type in ('way', 'relation'):
+                            if (element_type, element['id']) not in seen:
+                                seen.add((element_type, element['id']))
+                                (ways if element_type == 'way' else relations).append(element)
+            print(f"Found {len(ways)} ways and {len(relations)} relations")
         except Exception as e:
             print(f"Error querying Overpass API: {e}")
             return []
-        
+
         features = []
         processed_count = 0
         kept_count = 0
-        
-        for way in result.ways:
+        filtered_count = 0
+
+        candidates = []
+
+        for way in ways:
             processed_count += 1
             try:
-                coordinates = self.way_to_coordinates(way)
-                if len(coordinates) < 3:
+                if len(way.get('geometry') or way.get('nodes') or ()) < 3:
                     continue
-                
-                area = self.calculate_area(coordinates)
-                
-                if area >= self.min_area_sqm:
-                    feature = self.create_geojson_feature(way, coordinates, area)
-                    features.append(feature)
-                    kept_count += 1
-                    print(f"Kept way {way.id}: {area:.0f} sqm ({area/10000:.2f} ha)")
-                else:
-                    print(f"Filtered out way {way.id}: {area:.0f} sqm (too small)")
-                    
+
+                lons, lats = self.way_to_coordinates(way, nodes)
+                if lons.shape[0] < 3:
+                    continue
+
+                candidates.append((way, (lons, lats)))
+
             except Exception as e:
-                print(f"Error processing way {way.id}: {e}")
-        
-        for relation in result.relations:
+                logger.warning("Error processing way %s: %s", way['id'], e)
+
+        for relation in relations:
             processed_count += 1
             try:
-                coord_rings = self.relation_to_coordinates(relation)
-                if not coord_rings:
+                lons, lats = self.relation_to_coordinates(relation, nodes)
+                if lons.shape[0] < 3:
                     continue
-                
-                largest_ring = max(coord_rings, key=len) if coord_rings else []
-                if len(largest_ring) < 3:
-                    continue
-                
-                area = self.calculate_area(largest_ring)
-                
+
+                candidates.append((relation, (lons, lats)))
+
+            except Exception as e:
+                logger.warning("Error processing relation %s: %s", relation['id'], e)
+
+        areas = _batch_calculate_areas([ring for _, ring in candidates], min_area_sqm=self.min_area_sqm)
+
+        for (element, ring), area in zip(candidates, areas.tolist()):
+            try:
                 if area >= self.min_area_sqm:
-                    feature = self.create_geojson_feature(relation, largest_ring, area)
+                    feature = self.create_geojson_feature(element, ring, area)
                     features.append(feature)
                     kept_count += 1
-                    print(f"Kept relation {relation.id}: {area:.0f} sqm ({area/10000:.2f} ha)")
+                    logger.debug("Kept %s %s: %.0f sqm (%.2f ha)", element['type'], element['id'], area, area / 10000)
                 else:
-                    print(f"Filtered out relation {relation.id}: {area:.0f} sqm (too small)")
-                    
+                    filtered_count += 1
+                    logger.debug("Filtered out %s %s: %.0f sqm (too small)", element['type'], element['id'], area)
+
             except Exception as e:
-                print(f"Error processing relation {relation.id}: {e}")
-        
-        print(f"\nProcessed {processed_count} elements, kept {kept_count} large industrial areas")
+                logger.warning("Error processing %s %s: %s", element['type'], element['id'], e)
+
+        print(f"\nProcessed {processed_count} elements, kept {kept_count} large industrial areas, filtered out {filtered_count} small ones")
         self.filtered_features = features
         return features
     
@@ -261,8 +521,11 @@ class OSMIndustrialFilter:
             'properties': properties
         }
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(feature_collection, f, indent=2, ensure_ascii=False)
+        with open(filename, 'wb') as f:
+            if orjson is not None:
+                f.write(orjson.dumps(feature_collection, option=orjson.OPT_INDENT_2))
+            else:
+                f.write(json.dumps(feature_collection, indent=2, ensure_ascii=False).encode('utf-8'))
         
         country_info = f" in {self.country}" if self.country else ""
         print(f"Exported {len(self.filtered_features)} features{country_info} to {filename}")
@@ -308,10 +571,16 @@ def main():
                        help='Country name (e.g., "Netherlands", "Germany", "United States")')
     parser.add_argument('--output', type=str, default='large_industrial_areas.geojson',
                        help='Output GeoJSON filename')
+    parser.add_argument('--tile-degrees', type=float, default=2.0,
+                       help='Split the bounding box into tiles of this size in degrees (default: 2.0)')
     parser.add_argument('--josm', action='store_true',
                        help='Attempt to open in JOSM after export')
-    
+    parser.add_argument('--verbose', action='store_true',
+                       help='Log every kept/filtered element (slow on large runs)')
+
     args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format='%(message)s')
     
     if args.country and args.bbox:
         print("Error: Please specify either --country OR --bbox, not both")
@@ -334,9 +603,10 @@ def main():
             sys.exit(1)
     
     filter_tool = OSMIndustrialFilter(
-        min_area_sqm=args.min_area, 
-        bbox=bbox, 
-        country=args.country
+        min_area_sqm=args.min_area,
+        bbox=bbox,
+        country=args.country,
+        tile_degrees=args.tile_degrees
     )
     
     if not filter_tool.bbox: